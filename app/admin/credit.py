@@ -16,6 +16,7 @@ from app.core.credit import (
     list_fee_events_by_agent,
     recharge,
     reward,
+    reward_batch,
     update_daily_quota,
 )
 from models.credit import (
@@ -24,6 +25,7 @@ from models.credit import (
     Direction,
     EventType,
     OwnerType,
+    RewardItem,
 )
 from models.db import get_db
 from utils.middleware import create_jwt_middleware
@@ -62,6 +64,15 @@ class RewardRequest(BaseModel):
     ]
 
 
+class RewardBatchRequest(BaseModel):
+    """Request model for rewarding many user accounts at once."""
+
+    rewards: Annotated[
+        List[RewardItem],
+        Field(min_length=1, max_length=1000, description="Rewards to apply"),
+    ]
+
+
 # class AdjustmentRequest(BaseModel):
 #     """Request model for adjusting a user account."""
 
@@ -183,6 +194,32 @@ async def reward_user_account(
     )
 
 
+@credit_router.post(
+    "/reward/batch",
+    response_model=List[CreditAccount],
+    status_code=status.HTTP_201_CREATED,
+    operation_id="reward_accounts_batch",
+    summary="Reward Batch",
+    dependencies=[Depends(verify_jwt)],
+)
+async def reward_user_accounts_batch(
+    request: RewardBatchRequest,
+    db: AsyncSession = Depends(get_db),
+) -> List[CreditAccount]:
+    """Reward many user accounts in a single transaction.
+
+    The whole batch is rejected if any upstream_tx_id was already used.
+
+    Args:
+        request: Batch of reward details
+        db: Database session
+
+    Returns:
+        The updated credit accounts, one per distinct user
+    """
+    return await reward_batch(db, request.rewards)
+
+
 # @credit_router.post(
 #     "/adjust",
 #     response_model=CreditAccount,
@@ -62,6 +62,7 @@ class Config:
             raise ValueError("db config is not set")
         # ==== this part can be load from env or aws secrets manager
         self.db["auto_migrate"] = self.load("DB_AUTO_MIGRATE", "true") == "true"
+        self.db["pgbouncer"] = self.load("DB_PGBOUNCER", "false") == "true"
         self.debug = self.load("DEBUG") == "true"
         self.debug_checkpoint = (
             self.load("DEBUG_CHECKPOINT", "false") == "true"
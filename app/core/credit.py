@@ -1,11 +1,31 @@
 import logging
+from datetime import datetime, timezone
 from decimal import Decimal
-from typing import List, Optional, Tuple
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
 
+from asyncpg.exceptions import UniqueViolationError
 from epyxid import XID
 from fastapi import HTTPException
-from sqlalchemy import desc, select, update
+from sqlalchemy import (
+    Select,
+    Table,
+    bindparam,
+    column,
+    desc,
+    exists,
+    func,
+    insert,
+    literal,
+    select,
+    true,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import Label
 
 from app.config.config import config
 from models.credit import (
@@ -25,6 +45,7 @@ from models.credit import (
     Direction,
     EventType,
     OwnerType,
+    RewardItem,
     TransactionType,
     UpstreamType,
 )
@@ -32,6 +53,216 @@ from models.db import get_session
 
 logger = logging.getLogger(__name__)
 
+# Config is loaded once per process, convert the fee percentage only once
+_FEE_PLATFORM_PERCENTAGE = Decimal(str(config.payment_fee_platform_percentage))
+
+# Batches larger than this are written with COPY instead of multi-row INSERT
+_COPY_THRESHOLD = 100
+
+# Fixed-shape statements built once at import, values are bound per call
+_SELECT_EVENT_BY_UPSTREAM_TX_ID = select(CreditEventTable).where(
+    CreditEventTable.upstream_tx_id == bindparam("upstream_tx_id")
+)
+_NEW_FREE_QUOTA = func.coalesce(
+    bindparam("new_free_quota", type_=CreditAccountTable.free_quota.type),
+    CreditAccountTable.free_quota,
+)
+_NEW_REFILL_AMOUNT = func.coalesce(
+    bindparam("new_refill_amount", type_=CreditAccountTable.refill_amount.type),
+    CreditAccountTable.refill_amount,
+)
+_UPDATE_DAILY_QUOTA = (
+    update(CreditAccountTable)
+    .where(
+        CreditAccountTable.owner_type == OwnerType.USER,
+        CreditAccountTable.owner_id == bindparam("user_id"),
+        # Missing values keep the current ones, refill must stay within quota
+        _NEW_REFILL_AMOUNT <= _NEW_FREE_QUOTA,
+    )
+    .values(free_quota=_NEW_FREE_QUOTA, refill_amount=_NEW_REFILL_AMOUNT)
+    .returning(CreditAccountTable)
+)
+
+
+def _literal_columns(table: Table, values: Dict[str, Any]) -> List[Label]:
+    """Build typed literal columns for an INSERT ... SELECT statement."""
+    return [
+        literal(value, table.c[name].type).label(name) for name, value in values.items()
+    ]
+
+
+async def _copy_rows(
+    session: AsyncSession, table: Table, rows: List[Dict[str, Any]]
+) -> None:
+    """Write rows with COPY on the session's connection and transaction.
+
+    COPY bypasses SQLAlchemy, so scalar column defaults are filled in here and
+    columns with server defaults are left to the database.
+    """
+    columns = [c for c in table.columns if c.server_default is None]
+    records = []
+    for row in rows:
+        record = []
+        for c in columns:
+            if c.name in row:
+                value = row[c.name]
+            elif c.default is not None and c.default.is_scalar:
+                value = c.default.arg
+            else:
+                value = None
+            record.append(value.value if isinstance(value, Enum) else value)
+        records.append(tuple(record))
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        table.name, records=records, columns=[c.name for c in columns]
+    )
+
+
+def _recharge_statement(
+    user_id: str,
+    amount: Decimal,
+    upstream_tx_id: str,
+    note: Optional[str],
+    platform_account_id: str,
+    event_id: str,
+    user_tx_id: str,
+    platform_tx_id: str,
+) -> Select:
+    """
+    Build the recharge as a single statement of data-modifying CTEs.
+
+    The user account update, the event insert, the platform account update and
+    both transaction inserts are executed in one round-trip. The statement
+    returns the updated user account together with the new event id and the
+    updated platform account id.
+
+    No row is returned if the user account does not exist. The event id is NULL
+    if the upstream transaction already exists, and the platform account id is
+    NULL if the platform account was not found; the user account has still been
+    updated in both cases, so the caller must roll back.
+    """
+    credit_type = CreditType.PERMANENT
+    credit_column = getattr(CreditAccountTable, credit_type.value)
+
+    # 1. Update user account - add credits
+    user_account = (
+        update(CreditAccountTable)
+        .where(
+            CreditAccountTable.owner_type == OwnerType.USER,
+            CreditAccountTable.owner_id == user_id,
+        )
+        .values(
+            {
+                credit_type.value: credit_column + amount,
+                "income_at": func.now(),
+                "updated_at": func.now(),
+            }
+        )
+        .returning(
+            *CreditAccountTable.__table__.c,
+            (
+                CreditAccountTable.credits
+                + CreditAccountTable.free_credits
+                + CreditAccountTable.reward_credits
+            ).label("balance_after"),
+        )
+        .cte("user_account")
+    )
+
+    # 2. Create credit event record, skipped if the upstream tx already exists
+    event_values = {
+        "id": event_id,
+        "event_type": EventType.RECHARGE,
+        "upstream_type": UpstreamType.API,
+        "upstream_tx_id": upstream_tx_id,
+        "direction": Direction.INCOME,
+        "total_amount": amount,
+        "credit_type": credit_type,
+        "base_amount": amount,
+        "base_original_amount": amount,
+        "note": note,
+    }
+    event = (
+        pg_insert(CreditEventTable)
+        .from_select(
+            [*event_values, "account_id", "balance_after"],
+            select(
+                *_literal_columns(CreditEventTable.__table__, event_values),
+                user_account.c.id,
+                user_account.c.balance_after,
+            ),
+        )
+        .on_conflict_do_nothing(index_elements=["upstream_type", "upstream_tx_id"])
+        .returning(CreditEventTable.id)
+        .cte("event")
+    )
+
+    # 3. Update platform recharge account - deduct credits, only if event created
+    platform_account = (
+        update(CreditAccountTable)
+        .where(
+            CreditAccountTable.id == platform_account_id,
+            exists(select(event.c.id)),
+        )
+        .values(
+            {
+                credit_type.value: credit_column - amount,
+                "expense_at": func.now(),
+                "updated_at": func.now(),
+            }
+        )
+        .returning(CreditAccountTable.id)
+        .cte("platform_account")
+    )
+
+    # 4. Create credit transaction records
+    def transaction(tx_id: str, account, credit_debit: CreditDebit) -> Select:
+        return select(
+            *_literal_columns(CreditTransactionTable.__table__, {"id": tx_id}),
+            account.c.id.label("account_id"),
+            event.c.id.label("event_id"),
+            *_literal_columns(
+                CreditTransactionTable.__table__,
+                {
+                    "tx_type": TransactionType.RECHARGE,
+                    "credit_debit": credit_debit,
+                    "change_amount": amount,
+                    "credit_type": credit_type,
+                },
+            ),
+        ).select_from(account.join(event, true()))
+
+    transactions = insert(CreditTransactionTable).from_select(
+        [
+            "id",
+            "account_id",
+            "event_id",
+            "tx_type",
+            "credit_debit",
+            "change_amount",
+            "credit_type",
+        ],
+        union_all(
+            # 4.1 User account transaction (credit)
+            transaction(user_tx_id, user_account, CreditDebit.CREDIT),
+            # 4.2 Platform recharge account transaction (debit)
+            transaction(platform_tx_id, platform_account, CreditDebit.DEBIT),
+        ),
+    )
+
+    return (
+        select(
+            user_account,
+            event.c.id.label("event_id"),
+            platform_account.c.id.label("platform_account_id"),
+        )
+        .select_from(
+            user_account.outerjoin(event, true()).outerjoin(platform_account, true())
+        )
+        .add_cte(transactions.cte("transactions"))
+    )
+
 
 async def recharge(
     session: AsyncSession,
@@ -53,82 +284,55 @@ async def recharge(
     Returns:
         Updated user credit account
     """
-    # Check for idempotency - prevent duplicate transactions
-    await CreditEvent.check_upstream_tx_id_exists(
-        session, UpstreamType.API, upstream_tx_id
-    )
-
     if amount <= Decimal("0"):
         raise ValueError("Recharge amount must be positive")
 
-    # 1. Update user account - add credits
-    user_account = await CreditAccount.income_in_session(
-        session=session,
-        owner_type=OwnerType.USER,
-        owner_id=user_id,
-        amount=amount,
-        credit_type=CreditType.PERMANENT,  # Recharge adds to permanent credits
-    )
+    event_id, user_tx_id, platform_tx_id = [str(XID()) for _ in range(3)]
 
-    # 2. Update platform recharge account - deduct credits
-    platform_account = await CreditAccount.deduction_in_session(
-        session=session,
-        owner_type=OwnerType.PLATFORM,
-        owner_id=DEFAULT_PLATFORM_ACCOUNT_RECHARGE,
-        credit_type=CreditType.PERMANENT,
-        amount=amount,
+    # The platform account must exist before the fused statement deducts from it
+    platform_account_id = await CreditAccount.get_or_create_id_in_session(
+        session, OwnerType.PLATFORM, DEFAULT_PLATFORM_ACCOUNT_RECHARGE
     )
 
-    # 3. Create credit event record
-    event_id = str(XID())
-    event = CreditEventTable(
-        id=event_id,
-        event_type=EventType.RECHARGE,
-        upstream_type=UpstreamType.API,
-        upstream_tx_id=upstream_tx_id,
-        direction=Direction.INCOME,
-        account_id=user_account.id,
-        total_amount=amount,
-        credit_type=CreditType.PERMANENT,
-        balance_after=user_account.credits
-        + user_account.free_credits
-        + user_account.reward_credits,
-        base_amount=amount,
-        base_original_amount=amount,
-        note=note,
+    # Update both accounts and write the event and transactions in one round-trip
+    stmt = _recharge_statement(
+        user_id,
+        amount,
+        upstream_tx_id,
+        note,
+        platform_account_id,
+        event_id,
+        user_tx_id,
+        platform_tx_id,
     )
-    session.add(event)
-    await session.flush()
+    row = (await session.execute(stmt)).first()
+    if row is None:
+        # First recharge of a new user, create the account and try again
+        await CreditAccount.get_or_create_in_session(session, OwnerType.USER, user_id)
+        row = (await session.execute(stmt)).first()
+    if row is None:
+        raise HTTPException(status_code=500, detail="Failed to income credits")
 
-    # 4. Create credit transaction records
-    # 4.1 User account transaction (credit)
-    user_tx = CreditTransactionTable(
-        id=str(XID()),
-        account_id=user_account.id,
-        event_id=event_id,
-        tx_type=TransactionType.RECHARGE,
-        credit_debit=CreditDebit.CREDIT,
-        change_amount=amount,
-        credit_type=CreditType.PERMANENT,
-    )
-    session.add(user_tx)
+    # Check for idempotency - prevent duplicate transactions
+    if row.event_id is None:
+        await session.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=f"Transaction with upstream_tx_id '{upstream_tx_id}' already exists. Do not resubmit.",
+        )
 
-    # 4.2 Platform recharge account transaction (debit)
-    platform_tx = CreditTransactionTable(
-        id=str(XID()),
-        account_id=platform_account.id,
-        event_id=event_id,
-        tx_type=TransactionType.RECHARGE,
-        credit_debit=CreditDebit.DEBIT,
-        change_amount=amount,
-        credit_type=CreditType.PERMANENT,
-    )
-    session.add(platform_tx)
+    if row.platform_account_id is None:
+        # A cached platform account id may be stale, look it up next time
+        CreditAccount.evict_cached_id(
+            OwnerType.PLATFORM, DEFAULT_PLATFORM_ACCOUNT_RECHARGE
+        )
+        await session.rollback()
+        raise HTTPException(status_code=500, detail="Failed to expense credits")
 
     # Commit all changes
     await session.commit()
 
-    return user_account
+    return CreditAccount.model_validate(row._mapping)
 
 
 async def reward(
@@ -151,14 +355,11 @@ async def reward(
     Returns:
         Updated user credit account
     """
-    # Check for idempotency - prevent duplicate transactions
-    await CreditEvent.check_upstream_tx_id_exists(
-        session, UpstreamType.API, upstream_tx_id
-    )
-
     if amount <= Decimal("0"):
         raise ValueError("Reward amount must be positive")
 
+    event_id, user_tx_id, platform_tx_id = [str(XID()) for _ in range(3)]
+
     # 1. Update user account - add reward credits
     user_account = await CreditAccount.income_in_session(
         session=session,
@@ -177,9 +378,9 @@ async def reward(
         amount=amount,
     )
 
-    # 3. Create credit event record
-    event_id = str(XID())
-    event = CreditEventTable(
+    # 3. Create credit event record, the insert also guards idempotency
+    await CreditEvent.insert_in_session(
+        session,
         id=event_id,
         event_type=EventType.REWARD,
         upstream_type=UpstreamType.API,
@@ -188,45 +389,229 @@ async def reward(
         account_id=user_account.id,
         total_amount=amount,
         credit_type=CreditType.REWARD,
-        balance_after=user_account.credits
-        + user_account.free_credits
-        + user_account.reward_credits,
+        balance_after=user_account.balance_after,
         base_amount=amount,
         base_original_amount=amount,
         note=note,
     )
-    session.add(event)
-    await session.flush()
 
-    # 4. Create credit transaction records
-    # 4.1 User account transaction (credit)
-    user_tx = CreditTransactionTable(
-        id=str(XID()),
-        account_id=user_account.id,
-        event_id=event_id,
-        tx_type=TransactionType.REWARD,
-        credit_debit=CreditDebit.CREDIT,
-        change_amount=amount,
-        credit_type=CreditType.REWARD,
+    # 4. Create credit transaction records in a single multi-row INSERT
+    await session.execute(
+        insert(CreditTransactionTable),
+        [
+            # 4.1 User account transaction (credit)
+            {
+                "id": user_tx_id,
+                "account_id": user_account.id,
+                "event_id": event_id,
+                "tx_type": TransactionType.REWARD,
+                "credit_debit": CreditDebit.CREDIT,
+                "change_amount": amount,
+                "credit_type": CreditType.REWARD,
+            },
+            # 4.2 Platform reward account transaction (debit)
+            {
+                "id": platform_tx_id,
+                "account_id": platform_account.id,
+                "event_id": event_id,
+                "tx_type": TransactionType.REWARD,
+                "credit_debit": CreditDebit.DEBIT,
+                "change_amount": amount,
+                "credit_type": CreditType.REWARD,
+            },
+        ],
     )
-    session.add(user_tx)
 
-    # 4.2 Platform reward account transaction (debit)
-    platform_tx = CreditTransactionTable(
-        id=str(XID()),
-        account_id=platform_account.id,
-        event_id=event_id,
-        tx_type=TransactionType.REWARD,
-        credit_debit=CreditDebit.DEBIT,
-        change_amount=amount,
+    # Commit all changes
+    await session.commit()
+
+    return user_account
+
+
+async def reward_batch(
+    session: AsyncSession,
+    rewards: List[RewardItem],
+) -> List[CreditAccount]:
+    """
+    Reward many user accounts in a single transaction.
+
+    Balances are bumped with one UPDATE per batch, events and transactions are
+    written with one multi-row INSERT each, and everything is committed once.
+    The whole batch is rejected if any upstream_tx_id was already used.
+
+    Args:
+        session: Async session to use for database operations
+        rewards: Rewards to apply
+
+    Returns:
+        Updated user credit accounts, one per distinct user
+
+    Raises:
+        HTTPException: If any upstream_tx_id already exists
+    """
+    if not rewards:
+        return []
+    if any(item.amount <= Decimal("0") for item in rewards):
+        raise ValueError("Reward amount must be positive")
+
+    # Sum the rewards per user, a user may appear more than once in a batch
+    totals: Dict[str, Decimal] = {}
+    for item in rewards:
+        totals[item.user_id] = totals.get(item.user_id, Decimal("0")) + item.amount
+
+    # 1. Make sure every user has an account
+    existing = await session.scalars(
+        select(CreditAccountTable.owner_id).where(
+            CreditAccountTable.owner_type == OwnerType.USER,
+            CreditAccountTable.owner_id.in_(totals),
+        )
+    )
+    for user_id in totals.keys() - set(existing):
+        await CreditAccount.create_in_session(session, OwnerType.USER, user_id)
+
+    # 2. Update user accounts - add reward credits, one statement for all users
+    amounts = values(
+        column("owner_id", CreditAccountTable.owner_id.type),
+        column("amount", CreditAccountTable.reward_credits.type),
+        name="amounts",
+    ).data(list(totals.items()))
+    result = await session.scalars(
+        update(CreditAccountTable)
+        .where(
+            CreditAccountTable.owner_type == OwnerType.USER,
+            CreditAccountTable.owner_id == amounts.c.owner_id,
+        )
+        .values(
+            reward_credits=CreditAccountTable.reward_credits + amounts.c.amount,
+            income_at=datetime.now(timezone.utc),
+        )
+        .returning(CreditAccountTable),
+        # Accounts created above are already in the identity map, refresh them
+        execution_options={"populate_existing": True},
+    )
+    user_accounts = {
+        account.owner_id: account
+        for account in (CreditAccount.model_validate(row) for row in result)
+    }
+    if len(user_accounts) != len(totals):
+        raise HTTPException(status_code=500, detail="Failed to income credits")
+
+    # 3. Update platform reward account - deduct the batch total
+    platform_account = await CreditAccount.deduction_in_session(
+        session=session,
+        owner_type=OwnerType.PLATFORM,
+        owner_id=DEFAULT_PLATFORM_ACCOUNT_REWARD,
         credit_type=CreditType.REWARD,
+        amount=sum(totals.values()),
     )
-    session.add(platform_tx)
+
+    # 4. Build events and transactions, walking each user's rewards backwards
+    # from the final balance so balance_after matches the order of the batch
+    balances = {
+        user_id: account.credits + account.free_credits + account.reward_credits
+        for user_id, account in user_accounts.items()
+    }
+    # Ids are generated in batch order up front, XIDs sort by creation time
+    ids = [[str(XID()) for _ in range(3)] for _ in rewards]
+    events = []
+    transactions = []
+    for item, (event_id, user_tx_id, platform_tx_id) in zip(
+        reversed(rewards), reversed(ids)
+    ):
+        account_id = user_accounts[item.user_id].id
+        events.append(
+            {
+                "id": event_id,
+                "event_type": EventType.REWARD,
+                "upstream_type": UpstreamType.API,
+                "upstream_tx_id": item.upstream_tx_id,
+                "direction": Direction.INCOME,
+                "account_id": account_id,
+                "total_amount": item.amount,
+                "credit_type": CreditType.REWARD,
+                "balance_after": balances[item.user_id],
+                "base_amount": item.amount,
+                "base_original_amount": item.amount,
+                "note": item.note,
+            }
+        )
+        balances[item.user_id] -= item.amount
+        transactions.extend(
+            [
+                # User account transaction (credit)
+                {
+                    "id": user_tx_id,
+                    "account_id": account_id,
+                    "event_id": event_id,
+                    "tx_type": TransactionType.REWARD,
+                    "credit_debit": CreditDebit.CREDIT,
+                    "change_amount": item.amount,
+                    "credit_type": CreditType.REWARD,
+                },
+                # Platform reward account transaction (debit)
+                {
+                    "id": platform_tx_id,
+                    "account_id": platform_account.id,
+                    "event_id": event_id,
+                    "tx_type": TransactionType.REWARD,
+                    "credit_debit": CreditDebit.DEBIT,
+                    "change_amount": item.amount,
+                    "credit_type": CreditType.REWARD,
+                },
+            ]
+        )
+    events.reverse()
+
+    if len(rewards) > _COPY_THRESHOLD:
+        # 5. Large batches are written with COPY, which cannot skip conflicts,
+        # so check idempotency up front and map a lost race to the same error
+        upstream_tx_ids = [item.upstream_tx_id for item in rewards]
+        duplicated = len(set(upstream_tx_ids)) != len(upstream_tx_ids) or (
+            await session.scalar(
+                select(
+                    exists().where(
+                        CreditEventTable.upstream_type == UpstreamType.API,
+                        CreditEventTable.upstream_tx_id.in_(upstream_tx_ids),
+                    )
+                )
+            )
+        )
+        if not duplicated:
+            try:
+                await _copy_rows(session, CreditEventTable.__table__, events)
+            except UniqueViolationError:
+                duplicated = True
+        if duplicated:
+            await session.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail="Some upstream_tx_id in the batch already exist. Do not resubmit.",
+            )
+
+        # 6. Create credit transaction records
+        await _copy_rows(session, CreditTransactionTable.__table__, transactions)
+    else:
+        # 5. Create credit event records, the insert also guards idempotency
+        inserted = await session.scalars(
+            pg_insert(CreditEventTable)
+            .values(events)
+            .on_conflict_do_nothing(index_elements=["upstream_type", "upstream_tx_id"])
+            .returning(CreditEventTable.id)
+        )
+        if len(inserted.all()) != len(events):
+            await session.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail="Some upstream_tx_id in the batch already exist. Do not resubmit.",
+            )
+
+        # 6. Create credit transaction records in a single multi-row INSERT
+        await session.execute(insert(CreditTransactionTable), transactions)
 
     # Commit all changes
     await session.commit()
 
-    return user_account
+    return list(user_accounts.values())
 
 
 async def adjustment(
@@ -251,17 +636,14 @@ async def adjustment(
     Returns:
         Updated user credit account
     """
-    # Check for idempotency - prevent duplicate transactions
-    await CreditEvent.check_upstream_tx_id_exists(
-        session, UpstreamType.API, upstream_tx_id
-    )
-
     if amount == Decimal("0"):
         raise ValueError("Adjustment amount cannot be zero")
 
     if not note:
         raise ValueError("Adjustment requires a note explaining the reason")
 
+    event_id, user_tx_id, platform_tx_id = [str(XID()) for _ in range(3)]
+
     # Determine direction based on amount sign
     is_income = amount > Decimal("0")
     abs_amount = abs(amount)
@@ -308,9 +690,9 @@ async def adjustment(
             credit_type=credit_type,
         )
 
-    # 3. Create credit event record
-    event_id = str(XID())
-    event = CreditEventTable(
+    # 3. Create credit event record, the insert also guards idempotency
+    await CreditEvent.insert_in_session(
+        session,
         id=event_id,
         event_type=EventType.ADJUSTMENT,
         upstream_type=UpstreamType.API,
@@ -319,40 +701,38 @@ async def adjustment(
         account_id=user_account.id,
         total_amount=abs_amount,
         credit_type=credit_type,
-        balance_after=user_account.credits
-        + user_account.free_credits
-        + user_account.reward_credits,
+        balance_after=user_account.balance_after,
         base_amount=abs_amount,
         base_original_amount=abs_amount,
         note=note,
     )
-    session.add(event)
-    await session.flush()
 
-    # 4. Create credit transaction records
-    # 4.1 User account transaction
-    user_tx = CreditTransactionTable(
-        id=str(XID()),
-        account_id=user_account.id,
-        event_id=event_id,
-        tx_type=TransactionType.ADJUSTMENT,
-        credit_debit=credit_debit_user,
-        change_amount=abs_amount,
-        credit_type=credit_type,
+    # 4. Create credit transaction records in a single multi-row INSERT
+    await session.execute(
+        insert(CreditTransactionTable),
+        [
+            # 4.1 User account transaction
+            {
+                "id": user_tx_id,
+                "account_id": user_account.id,
+                "event_id": event_id,
+                "tx_type": TransactionType.ADJUSTMENT,
+                "credit_debit": credit_debit_user,
+                "change_amount": abs_amount,
+                "credit_type": credit_type,
+            },
+            # 4.2 Platform adjustment account transaction
+            {
+                "id": platform_tx_id,
+                "account_id": platform_account.id,
+                "event_id": event_id,
+                "tx_type": TransactionType.ADJUSTMENT,
+                "credit_debit": credit_debit_platform,
+                "change_amount": abs_amount,
+                "credit_type": credit_type,
+            },
+        ],
     )
-    session.add(user_tx)
-
-    # 4.2 Platform adjustment account transaction
-    platform_tx = CreditTransactionTable(
-        id=str(XID()),
-        account_id=platform_account.id,
-        event_id=event_id,
-        tx_type=TransactionType.ADJUSTMENT,
-        credit_debit=credit_debit_platform,
-        change_amount=abs_amount,
-        credit_type=credit_type,
-    )
-    session.add(platform_tx)
 
     # Commit all changes
     await session.commit()
@@ -391,44 +771,38 @@ async def update_daily_quota(
     if free_quota is None and refill_amount is None:
         raise ValueError("At least one of free_quota or refill_amount must be provided")
 
-    # Get current account to check existing values and validate
-    user_account = await CreditAccount.get_or_create_in_session(
-        session, OwnerType.USER, user_id, for_update=True
-    )
-
-    # Use existing values if not provided
-    if free_quota is None:
-        free_quota = user_account.free_quota
-    elif free_quota <= Decimal("0"):
+    # Validate the provided values, missing ones keep the current values
+    if free_quota is not None and free_quota <= Decimal("0"):
         raise ValueError("Daily quota must be positive")
 
-    if refill_amount is None:
-        refill_amount = user_account.refill_amount
-    elif refill_amount < Decimal("0"):
+    if refill_amount is not None and refill_amount < Decimal("0"):
         raise ValueError("Refill amount cannot be negative")
 
-    # Ensure refill_amount doesn't exceed free_quota
-    if refill_amount > free_quota:
-        raise ValueError("Refill amount cannot exceed daily quota")
-
     if not note:
         raise ValueError("Quota update requires a note explaining the reason")
 
-    # Already got the user account above, no need to get it again
-
-    # Update the free_quota field
-    stmt = (
-        update(CreditAccountTable)
-        .where(
-            CreditAccountTable.owner_type == OwnerType.USER,
-            CreditAccountTable.owner_id == user_id,
-        )
-        .values(free_quota=free_quota, refill_amount=refill_amount)
-        .returning(CreditAccountTable)
-    )
-    result = await session.scalar(stmt)
+    # Update in a single statement, the database ensures refill_amount
+    # doesn't exceed free_quota after merging with the current values
+    params = {
+        "user_id": user_id,
+        "new_free_quota": free_quota,
+        "new_refill_amount": refill_amount,
+    }
+    result = await session.scalar(_UPDATE_DAILY_QUOTA, params)
     if not result:
-        raise ValueError("Failed to update user account")
+        # Either the account does not exist yet or refill would exceed quota
+        account_id = await session.scalar(
+            select(CreditAccountTable.id).where(
+                CreditAccountTable.owner_type == OwnerType.USER,
+                CreditAccountTable.owner_id == user_id,
+            )
+        )
+        if account_id:
+            raise ValueError("Refill amount cannot exceed daily quota")
+        await CreditAccount.create_in_session(session, OwnerType.USER, user_id)
+        result = await session.scalar(_UPDATE_DAILY_QUOTA, params)
+        if not result:
+            raise ValueError("Refill amount cannot exceed daily quota")
 
     user_account = CreditAccount.model_validate(result)
 
@@ -474,7 +848,7 @@ async def list_credit_events_by_user(
 
     # 2. Build the query
     stmt = (
-        select(CreditEventTable)
+        select(*CreditEventTable.__table__.columns)
         .where(CreditEventTable.account_id == account.id)
         .order_by(desc(CreditEventTable.id))
         .limit(limit + 1)  # Fetch one extra to check if there are more
@@ -490,18 +864,18 @@ async def list_credit_events_by_user(
     if cursor:
         stmt = stmt.where(CreditEventTable.id < cursor)
 
-    # 5. Execute query
-    result = await session.execute(stmt)
-    events_data = result.scalars().all()
+    # 5. Execute query and convert rows to Pydantic models, the page is
+    # bounded by LIMIT so it is fetched in one round trip, read-only so skip
+    # autoflush
+    with session.no_autoflush:
+        result = await session.execute(stmt)
+        events_models = [CreditEvent.model_validate(row) for row in result.mappings()]
 
     # 6. Determine pagination details
-    has_more = len(events_data) > limit
-    events_to_return = events_data[:limit]  # Slice to the requested limit
+    has_more = len(events_models) > limit
+    events_models = events_models[:limit]  # Slice to the requested limit
 
-    next_cursor = events_to_return[-1].id if events_to_return else None
-
-    # 7. Convert to Pydantic models
-    events_models = [CreditEvent.model_validate(event) for event in events_to_return]
+    next_cursor = events_models[-1].id if events_models else None
 
     return events_models, next_cursor, has_more
 
@@ -537,7 +911,7 @@ async def list_fee_events_by_agent(
 
     # 2. Build the query to find events where fee_agent_amount > 0 and fee_agent_account = agent_account.id
     stmt = (
-        select(CreditEventTable)
+        select(*CreditEventTable.__table__.columns)
         .where(CreditEventTable.fee_agent_account == agent_account.id)
         .where(CreditEventTable.fee_agent_amount > 0)
         .order_by(desc(CreditEventTable.id))
@@ -548,18 +922,18 @@ async def list_fee_events_by_agent(
     if cursor:
         stmt = stmt.where(CreditEventTable.id < cursor)
 
-    # 4. Execute query
-    result = await session.execute(stmt)
-    events_data = result.scalars().all()
+    # 4. Execute query and convert rows to Pydantic models, the page is
+    # bounded by LIMIT so it is fetched in one round trip, read-only so skip
+    # autoflush
+    with session.no_autoflush:
+        result = await session.execute(stmt)
+        events_models = [CreditEvent.model_validate(row) for row in result.mappings()]
 
     # 5. Determine pagination details
-    has_more = len(events_data) > limit
-    events_to_return = events_data[:limit]  # Slice to the requested limit
+    has_more = len(events_models) > limit
+    events_models = events_models[:limit]  # Slice to the requested limit
 
-    next_cursor = events_to_return[-1].id if events_to_return else None
-
-    # 6. Convert to Pydantic models
-    events_models = [CreditEvent.model_validate(event) for event in events_to_return]
+    next_cursor = events_models[-1].id if events_models else None
 
     return events_models, next_cursor, has_more
 
@@ -581,13 +955,10 @@ async def fetch_credit_event_by_upstream_tx_id(
     Raises:
         HTTPException: If the credit event is not found.
     """
-    # Build the query to find the event by upstream_tx_id
-    stmt = select(CreditEventTable).where(
-        CreditEventTable.upstream_tx_id == upstream_tx_id
-    )
-
     # Execute query
-    result = await session.scalar(stmt)
+    result = await session.scalar(
+        _SELECT_EVENT_BY_UPSTREAM_TX_ID, {"upstream_tx_id": upstream_tx_id}
+    )
 
     # Raise 404 if not found
     if not result:
@@ -626,20 +997,15 @@ async def expense_message(
     Returns:
         Updated user credit account
     """
-    # Check for idempotency - prevent duplicate transactions
-    await CreditEvent.check_upstream_tx_id_exists(
-        session, UpstreamType.EXECUTOR, message_id
-    )
-
     if base_llm_amount < Decimal("0"):
         raise ValueError("Base LLM amount must be non-negative")
 
+    event_id, user_tx_id, platform_tx_id, agent_tx_id = [str(XID()) for _ in range(4)]
+
     # Calculate amount
     base_original_amount = base_llm_amount
     base_amount = base_original_amount
-    fee_platform_amount = base_amount * Decimal(
-        str(config.payment_fee_platform_percentage)
-    )
+    fee_platform_amount = base_amount * _FEE_PLATFORM_PERCENTAGE
     fee_agent_amount = (
         base_amount * agent_fee_percentage
         if user_id != agent_owner_id
@@ -647,6 +1013,14 @@ async def expense_message(
     )
     total_amount = base_amount + fee_platform_amount + fee_agent_amount
 
+    # Free messages move no credits, so there is nothing to write
+    if total_amount == 0:
+        user_account = await CreditAccount.get_or_create_in_session(
+            session, OwnerType.USER, user_id
+        )
+        await session.commit()
+        return user_account
+
     # 1. Update user account - deduct credits
     user_account, credit_type = await CreditAccount.expense_in_session(
         session=session,
@@ -656,13 +1030,14 @@ async def expense_message(
     )
 
     # 2. Update fee account - add credits
-    platform_account = await CreditAccount.income_in_session(
-        session=session,
-        owner_type=OwnerType.PLATFORM,
-        owner_id=DEFAULT_PLATFORM_ACCOUNT_FEE,
-        credit_type=credit_type,
-        amount=fee_platform_amount,
-    )
+    if fee_platform_amount > 0:
+        platform_account = await CreditAccount.income_in_session(
+            session=session,
+            owner_type=OwnerType.PLATFORM,
+            owner_id=DEFAULT_PLATFORM_ACCOUNT_FEE,
+            credit_type=credit_type,
+            amount=fee_platform_amount,
+        )
     if fee_agent_amount > 0:
         agent_account = await CreditAccount.income_in_session(
             session=session,
@@ -672,9 +1047,9 @@ async def expense_message(
             amount=fee_agent_amount,
         )
 
-    # 3. Create credit event record
-    event_id = str(XID())
-    event = CreditEventTable(
+    # 3. Create credit event record, the insert also guards idempotency
+    await CreditEvent.insert_in_session(
+        session,
         id=event_id,
         account_id=user_account.id,
         event_type=EventType.MESSAGE,
@@ -686,9 +1061,7 @@ async def expense_message(
         start_message_id=start_message_id,
         total_amount=total_amount,
         credit_type=credit_type,
-        balance_after=user_account.credits
-        + user_account.free_credits
-        + user_account.reward_credits,
+        balance_after=user_account.balance_after,
         base_amount=base_amount,
         base_original_amount=base_original_amount,
         base_llm_amount=base_llm_amount,
@@ -696,46 +1069,51 @@ async def expense_message(
         fee_agent_amount=fee_agent_amount,
         fee_agent_account=agent_account.id if fee_agent_amount > 0 else None,
     )
-    session.add(event)
-    await session.flush()
 
     # 4. Create credit transaction records
-    # 4.1 User account transaction (debit)
-    user_tx = CreditTransactionTable(
-        id=str(XID()),
-        account_id=user_account.id,
-        event_id=event_id,
-        tx_type=TransactionType.PAY,
-        credit_debit=CreditDebit.DEBIT,
-        change_amount=total_amount,
-        credit_type=credit_type,
-    )
-    session.add(user_tx)
+    transactions = [
+        # 4.1 User account transaction (debit)
+        {
+            "id": user_tx_id,
+            "account_id": user_account.id,
+            "event_id": event_id,
+            "tx_type": TransactionType.PAY,
+            "credit_debit": CreditDebit.DEBIT,
+            "change_amount": total_amount,
+            "credit_type": credit_type,
+        },
+    ]
 
     # 4.2 Platform fee account transaction (credit)
-    platform_tx = CreditTransactionTable(
-        id=str(XID()),
-        account_id=platform_account.id,
-        event_id=event_id,
-        tx_type=TransactionType.RECEIVE_FEE_PLATFORM,
-        credit_debit=CreditDebit.CREDIT,
-        change_amount=fee_platform_amount,
-        credit_type=credit_type,
-    )
-    session.add(platform_tx)
+    if fee_platform_amount > 0:
+        transactions.append(
+            {
+                "id": platform_tx_id,
+                "account_id": platform_account.id,
+                "event_id": event_id,
+                "tx_type": TransactionType.RECEIVE_FEE_PLATFORM,
+                "credit_debit": CreditDebit.CREDIT,
+                "change_amount": fee_platform_amount,
+                "credit_type": credit_type,
+            }
+        )
 
     # 4.3 Agent fee account transaction (credit)
     if fee_agent_amount > 0:
-        agent_tx = CreditTransactionTable(
-            id=str(XID()),
-            account_id=agent_account.id,
-            event_id=event_id,
-            tx_type=TransactionType.RECEIVE_FEE_AGENT,
-            credit_debit=CreditDebit.CREDIT,
-            change_amount=fee_agent_amount,
-            credit_type=credit_type,
+        transactions.append(
+            {
+                "id": agent_tx_id,
+                "account_id": agent_account.id,
+                "event_id": event_id,
+                "tx_type": TransactionType.RECEIVE_FEE_AGENT,
+                "credit_debit": CreditDebit.CREDIT,
+                "change_amount": fee_agent_amount,
+                "credit_type": credit_type,
+            }
         )
-        session.add(agent_tx)
+
+    # Write all transactions in a single multi-row INSERT
+    await session.execute(insert(CreditTransactionTable), transactions)
 
     # Commit all changes
     await session.commit()
@@ -789,9 +1167,7 @@ async def expense_skill(
     # Calculate amount
     base_original_amount = base_skill_amount
     base_amount = base_original_amount
-    fee_platform_amount = base_amount * Decimal(
-        str(config.payment_fee_platform_percentage)
-    )
+    fee_platform_amount = base_amount * _FEE_PLATFORM_PERCENTAGE
     fee_agent_amount = (
         base_amount * agent_fee_percentage
         if user_id != agent_owner_id
@@ -847,9 +1223,7 @@ async def expense_skill(
         start_message_id=start_message_id,
         total_amount=total_amount,
         credit_type=credit_type,
-        balance_after=user_account.credits
-        + user_account.free_credits
-        + user_account.reward_credits,
+        balance_after=user_account.balance_after,
         base_amount=base_amount,
         base_original_amount=base_original_amount,
         base_skill_amount=base_skill_amount,
@@ -860,7 +1234,6 @@ async def expense_skill(
         fee_dev_account=dev_account.id if fee_dev_amount > 0 else None,
     )
     session.add(event)
-    await session.flush()
 
     # 4. Create credit transaction records
     # 4.1 User account transaction (debit)
@@ -975,15 +1348,12 @@ async def refill_free_credits_for_account(
         direction=Direction.INCOME,
         credit_type=CreditType.FREE,
         total_amount=amount_to_add,
-        balance_after=updated_account.credits
-        + updated_account.free_credits
-        + updated_account.reward_credits,
+        balance_after=updated_account.balance_after,
         base_amount=amount_to_add,
         base_original_amount=amount_to_add,
         note=f"Hourly free credits refill of {amount_to_add}",
     )
     session.add(event)
-    await session.flush()
 
     # 4. Create credit transaction records
     # 4.1 User account transaction (credit)
@@ -1,5 +1,6 @@
 """Twitter OAuth2 authentication module."""
 
+import threading
 from urllib.parse import urlencode
 
 from fastapi import APIRouter, Depends
@@ -31,6 +32,9 @@ class OAuth2UserHandler(OAuth2Session):
         self.code_challenge = self._client.create_code_challenge(
             self._client.create_code_verifier(128), "S256"
         )
+        # fetch_token and refresh_token keep per-call state on the shared
+        # client, serialize them since they are called from worker threads
+        self._lock = threading.Lock()
 
     def get_authorization_url(self, agent_id: str, redirect_uri: str):
         """Get the authorization URL to redirect the user to
@@ -52,21 +56,23 @@ class OAuth2UserHandler(OAuth2Session):
         """After user has authorized the app, fetch access token with
         authorization response URL
         """
-        return super().fetch_token(
-            "https://api.x.com/2/oauth2/token",
-            authorization_response=authorization_response,
-            auth=self.auth,
-            include_client_id=True,
-            code_verifier=self._client.code_verifier,
-        )
+        with self._lock:
+            return super().fetch_token(
+                "https://api.x.com/2/oauth2/token",
+                authorization_response=authorization_response,
+                auth=self.auth,
+                include_client_id=True,
+                code_verifier=self._client.code_verifier,
+            )
 
     def refresh(self, refresh_token: str):
         """Refresh token"""
-        return super().refresh_token(
-            "https://api.x.com/2/oauth2/token",
-            refresh_token=refresh_token,
-            include_client_id=True,
-        )
+        with self._lock:
+            return super().refresh_token(
+                "https://api.x.com/2/oauth2/token",
+                refresh_token=refresh_token,
+                include_client_id=True,
+            )
 
 
 # Initialize Twitter OAuth2 client
@@ -1,16 +1,19 @@
 """Twitter OAuth2 callback handler."""
 
+import asyncio
 from datetime import datetime, timezone
 from typing import Optional
 from urllib.parse import parse_qs, urlencode, urlparse
 
 import tweepy
 from fastapi import APIRouter, HTTPException
+from sqlalchemy import select
 from starlette.responses import JSONResponse, RedirectResponse
 
 from app.config.config import config
 from app.services.twitter.oauth2 import oauth2_user_handler
-from models.agent import Agent, AgentData
+from models.agent import AgentData, AgentTable
+from models.db import get_session
 
 router = APIRouter(prefix="/callback/auth", tags=["Callback"])
 
@@ -71,40 +74,44 @@ async def twitter_oauth_callback(
                 status_code=400, detail="Missing agent_id in state parameter"
             )
 
-        agent = await Agent.get(agent_id)
-        if not agent:
+        async with get_session() as db:
+            exists = await db.scalar(
+                select(AgentTable.id).where(AgentTable.id == agent_id)
+            )
+        if not exists:
             raise HTTPException(status_code=404, detail=f"Agent {agent_id} not found")
 
-        agent_data = await AgentData.get(agent_id)
-        if not agent_data:
-            agent_data = AgentData(id=agent_id)
-
         # Exchange code for tokens
         authorization_response = (
             f"{config.twitter_oauth2_redirect_uri}?state={state}&code={code}"
         )
-        token = oauth2_user_handler.get_token(authorization_response)
-
-        # Store tokens in database
-        agent_data.twitter_access_token = token["access_token"]
-        agent_data.twitter_refresh_token = token["refresh_token"]
-        agent_data.twitter_access_token_expires_at = datetime.fromtimestamp(
-            token["expires_at"], tz=timezone.utc
+        # tweepy is synchronous, run its HTTP calls off the event loop
+        token = await asyncio.to_thread(
+            oauth2_user_handler.get_token, authorization_response
         )
 
+        # Tokens to store in database
+        data = {
+            "twitter_access_token": token["access_token"],
+            "twitter_refresh_token": token["refresh_token"],
+            "twitter_access_token_expires_at": datetime.fromtimestamp(
+                token["expires_at"], tz=timezone.utc
+            ),
+        }
+
         # Get user info
         client = tweepy.Client(bearer_token=token["access_token"], return_type=dict)
-        me = client.get_me(user_auth=False)
+        me = await asyncio.to_thread(client.get_me, user_auth=False)
 
         username = None
         if me and "data" in me:
-            agent_data.twitter_id = me.get("data").get("id")
             username = me.get("data").get("username")
-            agent_data.twitter_username = username
-            agent_data.twitter_name = me.get("data").get("name")
+            data["twitter_id"] = me.get("data").get("id")
+            data["twitter_username"] = username
+            data["twitter_name"] = me.get("data").get("name")
 
-        # Commit changes
-        await agent_data.save()
+        # Upsert agent data in a single statement
+        await AgentData.patch(agent_id, data)
 
         # Handle response based on redirect_uri
         if redirect_uri and is_valid_url(redirect_uri):
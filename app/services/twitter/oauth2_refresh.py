@@ -1,5 +1,6 @@
 """Twitter OAuth2 token refresh functionality."""
 
+import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
 
@@ -46,7 +47,10 @@ async def refresh_token(agent_data_record: AgentDataTable):
     """
     try:
         # Get new token using refresh token
-        token = oauth2_user_handler.refresh(agent_data_record.twitter_refresh_token)
+        # Run in a worker thread, the handler lock may be held by a callback
+        token = await asyncio.to_thread(
+            oauth2_user_handler.refresh, agent_data_record.twitter_refresh_token
+        )
 
         token = {} if token is None else token
 
@@ -26,6 +26,7 @@ from sqlalchemy import (
     select,
 )
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from models.base import Base
 from models.db import get_session
@@ -1828,7 +1829,7 @@ class AgentData(BaseModel):
 
     @staticmethod
     async def patch(id: str, data: dict) -> "AgentData":
-        """Update agent data.
+        """Update agent data, creating the record if it does not exist.
 
         Args:
             id: ID of the agent
@@ -1840,16 +1841,21 @@ class AgentData(BaseModel):
         Raises:
             HTTPException: If there are database errors
         """
+        # Single INSERT ... ON CONFLICT DO UPDATE ... RETURNING round trip
+        stmt = (
+            pg_insert(AgentDataTable)
+            .values(id=id, **data)
+            .on_conflict_do_update(
+                index_elements=[AgentDataTable.id],
+                set_={**data, "updated_at": datetime.now(timezone.utc)},
+            )
+            .returning(AgentDataTable)
+        )
         async with get_session() as db:
-            agent_data = await db.get(AgentDataTable, id)
-            if not agent_data:
-                agent_data = AgentDataTable(id=id, **data)
-                db.add(agent_data)
-            else:
-                for key, value in data.items():
-                    setattr(agent_data, key, value)
+            agent_data = await db.scalar(
+                stmt, execution_options={"populate_existing": True}
+            )
             await db.commit()
-            await db.refresh(agent_data)
             return AgentData.model_validate(agent_data)
 
 
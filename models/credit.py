@@ -5,7 +5,7 @@ from typing import Annotated, Any, Optional, Tuple
 
 from epyxid import XID
 from fastapi import HTTPException
-from pydantic import BaseModel, ConfigDict, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_validator
 from sqlalchemy import (
     Column,
     DateTime,
@@ -14,8 +14,11 @@ from sqlalchemy import (
     String,
     func,
     select,
+    text,
     update,
 )
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from models.base import Base
@@ -48,6 +51,10 @@ DEFAULT_PLATFORM_ACCOUNT_REFUND = "platform_refund"
 DEFAULT_PLATFORM_ACCOUNT_FEE = "platform_fee"
 DEFAULT_PLATFORM_ACCOUNT_DEV = "platform_dev"
 
+# Platform accounts are permanent and their ids never change, so once an account
+# has been found in the database its id is cached and the lookup is skipped.
+_platform_account_ids: dict[tuple[OwnerType, str], str] = {}
+
 
 class CreditAccountTable(Base):
     """Credit account database table model."""
@@ -113,6 +120,14 @@ class CreditAccountTable(Base):
     )
 
 
+# Total balance computed by the database, returned alongside updated accounts
+_BALANCE_AFTER = (
+    CreditAccountTable.credits
+    + CreditAccountTable.free_credits
+    + CreditAccountTable.reward_credits
+).label("balance_after")
+
+
 class CreditAccount(BaseModel):
     """Credit account model with all fields."""
 
@@ -173,6 +188,22 @@ class CreditAccount(BaseModel):
         datetime, Field(description="Timestamp when this account was last updated")
     ]
 
+    _balance_after: Optional[Decimal] = PrivateAttr(default=None)
+
+    @property
+    def balance_after(self) -> Decimal:
+        """Total balance, as returned by the update when available."""
+        if self._balance_after is not None:
+            return self._balance_after
+        return self.credits + self.free_credits + self.reward_credits
+
+    @classmethod
+    def _from_update_row(cls, row: Row) -> "CreditAccount":
+        """Build an account from an UPDATE ... RETURNING account, balance row."""
+        account = cls.model_validate(row[0])
+        account._balance_after = row.balance_after
+        return account
+
     @field_validator(
         "free_quota", "refill_amount", "free_credits", "reward_credits", "credits"
     )
@@ -240,9 +271,51 @@ class CreditAccount(BaseModel):
             account = await cls.create_in_session(session, owner_type, owner_id)
         else:
             account = cls.model_validate(result)
+            if owner_type == OwnerType.PLATFORM:
+                _platform_account_ids[(owner_type, owner_id)] = account.id
 
         return account
 
+    @classmethod
+    async def get_or_create_id_in_session(
+        cls,
+        session: AsyncSession,
+        owner_type: OwnerType,
+        owner_id: str,
+    ) -> str:
+        """Get the ID of a credit account, create the account if it doesn't exist.
+
+        Non-platform accounts are locked for update. Platform account ids are
+        served from the in-process cache without a query when possible.
+
+        Args:
+            session: Async session to use for database queries
+            owner_type: Type of the owner
+            owner_id: ID of the owner
+
+        Returns:
+            str: ID of the credit account
+        """
+        if owner_type == OwnerType.PLATFORM:
+            account_id = _platform_account_ids.get((owner_type, owner_id))
+            if account_id:
+                return account_id
+        account = await cls.get_or_create_in_session(
+            session, owner_type, owner_id, for_update=True
+        )
+        return account.id
+
+    @classmethod
+    def evict_cached_id(cls, owner_type: OwnerType, owner_id: str) -> None:
+        """Forget a cached platform account id so the next call looks it up.
+
+        Args:
+            owner_type: Type of the owner
+            owner_id: ID of the owner
+        """
+        if owner_type == OwnerType.PLATFORM:
+            _platform_account_ids.pop((owner_type, owner_id), None)
+
     @classmethod
     async def get_or_create(
         cls, owner_type: OwnerType, owner_id: str
@@ -270,16 +343,13 @@ class CreditAccount(BaseModel):
     ) -> "CreditAccount":
         """Deduct credits from an account. Not checking balance"""
         # check first, create if not exists
-        await cls.get_or_create_in_session(
-            session, owner_type, owner_id, for_update=True
+        account_id = await cls.get_or_create_id_in_session(
+            session, owner_type, owner_id
         )
 
         stmt = (
             update(CreditAccountTable)
-            .where(
-                CreditAccountTable.owner_type == owner_type,
-                CreditAccountTable.owner_id == owner_id,
-            )
+            .where(CreditAccountTable.id == account_id)
             .values(
                 {
                     credit_type.value: getattr(CreditAccountTable, credit_type.value)
@@ -287,12 +357,14 @@ class CreditAccount(BaseModel):
                     "expense_at": datetime.now(timezone.utc),
                 }
             )
-            .returning(CreditAccountTable)
+            .returning(CreditAccountTable, _BALANCE_AFTER)
         )
-        res = await session.scalar(stmt)
+        res = (await session.execute(stmt)).first()
         if not res:
+            # A cached platform account id may be stale, look it up next time
+            cls.evict_cached_id(owner_type, owner_id)
             raise HTTPException(status_code=500, detail="Failed to expense credits")
-        return cls.model_validate(res)
+        return cls._from_update_row(res)
 
     @classmethod
     async def expense_in_session(
@@ -331,12 +403,12 @@ class CreditAccount(BaseModel):
                     "expense_at": datetime.now(timezone.utc),
                 }
             )
-            .returning(CreditAccountTable)
+            .returning(CreditAccountTable, _BALANCE_AFTER)
         )
-        res = await session.scalar(stmt)
+        res = (await session.execute(stmt)).first()
         if not res:
             raise HTTPException(status_code=500, detail="Failed to expense credits")
-        return cls.model_validate(res), credit_type
+        return cls._from_update_row(res), credit_type
 
     def has_sufficient_credits(self, amount: Decimal) -> bool:
         """Check if the account has enough credits to cover the specified amount.
@@ -359,16 +431,13 @@ class CreditAccount(BaseModel):
         credit_type: CreditType,
     ) -> "CreditAccount":
         # check first, create if not exists
-        await cls.get_or_create_in_session(
-            session, owner_type, owner_id, for_update=True
+        account_id = await cls.get_or_create_id_in_session(
+            session, owner_type, owner_id
         )
         # income
         stmt = (
             update(CreditAccountTable)
-            .where(
-                CreditAccountTable.owner_type == owner_type,
-                CreditAccountTable.owner_id == owner_id,
-            )
+            .where(CreditAccountTable.id == account_id)
             .values(
                 {
                     credit_type.value: getattr(CreditAccountTable, credit_type.value)
@@ -376,12 +445,14 @@ class CreditAccount(BaseModel):
                     "income_at": datetime.now(timezone.utc),
                 }
             )
-            .returning(CreditAccountTable)
+            .returning(CreditAccountTable, _BALANCE_AFTER)
         )
-        res = await session.scalar(stmt)
+        res = (await session.execute(stmt)).first()
         if not res:
+            # A cached platform account id may be stale, look it up next time
+            cls.evict_cached_id(owner_type, owner_id)
             raise HTTPException(status_code=500, detail="Failed to income credits")
-        return cls.model_validate(res)
+        return cls._from_update_row(res)
 
     @classmethod
     async def create_in_session(
@@ -454,7 +525,6 @@ class CreditAccount(BaseModel):
                 note="Initial refill",
             )
             session.add(event)
-            await session.flush()
 
             # Create credit transaction records
             # 1. User account transaction (credit)
@@ -526,6 +596,22 @@ class CreditEventTable(Base):
         Index("ix_credit_events_account_id", "account_id"),
         Index("ix_credit_events_fee_agent", "fee_agent_amount", "fee_agent_account"),
         Index("ix_credit_events_fee_dev", "fee_dev_amount", "fee_dev_account"),
+        # Keyset pagination indexes for the event listing APIs, existing
+        # databases get them from migrate_indexes_concurrently
+        Index("ix_credit_events_account_direction_id", "account_id", "direction", "id"),
+        Index(
+            "ix_credit_events_fee_agent_account_id",
+            "fee_agent_account",
+            "id",
+            postgresql_where=text("fee_agent_amount > 0"),
+        ),
+        # Equality-only lookups by upstream_tx_id, existing databases get it
+        # from migrate_indexes_concurrently
+        Index(
+            "ix_credit_events_upstream_tx_id_hash",
+            "upstream_tx_id",
+            postgresql_using="hash",
+        ),
     )
 
     id = Column(
@@ -677,6 +763,36 @@ class CreditEvent(BaseModel):
                 detail=f"Transaction with upstream_tx_id '{upstream_tx_id}' already exists. Do not resubmit.",
             )
 
+    @classmethod
+    async def insert_in_session(cls, session: AsyncSession, **values: Any) -> None:
+        """
+        Insert an event, using the unique upstream index as the idempotency guard.
+        The existence check and the insert are a single atomic statement, so there
+        is no extra round-trip and no window for a concurrent duplicate.
+        If the event already exists, the session is rolled back so that any account
+        changes made before the event insert are discarded.
+
+        Args:
+            session: Database session
+            **values: Column values of the credit event
+
+        Raises:
+            HTTPException: If a transaction with the same upstream_tx_id already exists
+        """
+        stmt = (
+            pg_insert(CreditEventTable)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=["upstream_type", "upstream_tx_id"])
+            .returning(CreditEventTable.id)
+        )
+        result = await session.scalar(stmt)
+        if result is None:
+            await session.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail=f"Transaction with upstream_tx_id '{values['upstream_tx_id']}' already exists. Do not resubmit.",
+            )
+
     id: Annotated[
         str,
         Field(
@@ -785,6 +901,19 @@ class CreditEvent(BaseModel):
     ]
 
 
+class RewardItem(BaseModel):
+    """A single reward in a batch of rewards."""
+
+    upstream_tx_id: Annotated[
+        str, Field(description="Upstream transaction ID, idempotence Check")
+    ]
+    user_id: Annotated[str, Field(description="ID of the user to reward")]
+    amount: Annotated[Decimal, Field(gt=Decimal("0"), description="Amount to reward")]
+    note: Annotated[
+        Optional[str], Field(None, description="Optional note for the reward")
+    ]
+
+
 class TransactionType(str, Enum):
     """Type of credit transaction."""
 
@@ -1,11 +1,13 @@
 from contextlib import asynccontextmanager
 from typing import Annotated, AsyncGenerator
 from urllib.parse import quote_plus
+from uuid import uuid4
 
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from psycopg_pool import AsyncConnectionPool
 from pydantic import Field
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
 
 from models.db_mig import safe_migrate
 
@@ -22,6 +24,13 @@ async def init_db(
     auto_migrate: Annotated[
         bool, Field(default=True, description="Whether to run migrations automatically")
     ],
+    pgbouncer: Annotated[
+        bool,
+        Field(
+            default=False,
+            description="Whether the database sits behind PgBouncer in transaction mode",
+        ),
+    ] = False,
 ) -> None:
     """Initialize the database and handle schema updates.
 
@@ -32,6 +41,9 @@ async def init_db(
         dbname: Database name
         port: Database port (default: 5432)
         auto_migrate: Whether to run migrations automatically (default: True)
+        pgbouncer: Whether the database sits behind PgBouncer in transaction mode,
+            in which case PgBouncer owns pooling and prepared statements are
+            disabled or uniquely named (default: False)
     """
     global engine, _pool
     # Initialize psycopg pool if not already initialized
@@ -42,17 +54,36 @@ async def init_db(
             max_size=20,
             timeout=60,
             max_idle=30 * 60,
+            # Server-side prepared statements don't survive PgBouncer
+            # transaction mode, disable them for the checkpointer connections
+            kwargs={"prepare_threshold": None} if pgbouncer else None,
         )
     # Initialize SQLAlchemy engine with pool settings
     if engine is None:
-        engine = create_async_engine(
-            f"postgresql+asyncpg://{username}:{quote_plus(password)}@{host}:{port}/{dbname}",
-            pool_size=20,  # Increase pool size
-            max_overflow=30,  # Increase max overflow
-            pool_timeout=60,  # Increase timeout
-            pool_pre_ping=True,  # Enable connection health checks
-            pool_recycle=3600,  # Recycle connections after 1 hour
-        )
+        url = f"postgresql+asyncpg://{username}:{quote_plus(password)}@{host}:{port}/{dbname}"
+        if pgbouncer:
+            # PgBouncer transaction mode can hand each transaction a different
+            # server connection, so it must own pooling, prepared statements
+            # cannot be reused across transactions, and the ones asyncpg still
+            # creates need unique names to not collide on a server connection
+            engine = create_async_engine(
+                url,
+                poolclass=NullPool,
+                connect_args={
+                    "statement_cache_size": 0,
+                    "prepared_statement_cache_size": 0,
+                    "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+                },
+            )
+        else:
+            engine = create_async_engine(
+                f"{url}?prepared_statement_cache_size=200",  # Cache hot lookup plans
+                pool_size=20,
+                max_overflow=10,
+                pool_timeout=30,
+                pool_pre_ping=True,  # Enable connection health checks
+                pool_recycle=1800,  # Recycle connections after 30 minutes
+            )
         if auto_migrate:
             await safe_migrate(engine)
             async with _pool.connection() as conn:
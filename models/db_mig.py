@@ -1,5 +1,6 @@
 """Database migration utilities."""
 
+import asyncio
 import logging
 from typing import Callable
 
@@ -50,6 +51,79 @@ async def add_column_if_not_exists(
         logger.info(f"Added column {column.name} to table {table_name}")
 
 
+# Indexes added to existing, write-heavy tables. create_all only builds the
+# indexes of new tables, so these are built concurrently outside of the
+# migration transaction to avoid blocking writes while they build.
+CONCURRENT_INDEXES = {
+    "ix_credit_events_account_direction_id": "CREATE INDEX CONCURRENTLY "
+    "ix_credit_events_account_direction_id "
+    "ON credit_events (account_id, direction, id)",
+    "ix_credit_events_fee_agent_account_id": "CREATE INDEX CONCURRENTLY "
+    "ix_credit_events_fee_agent_account_id "
+    "ON credit_events (fee_agent_account, id) WHERE fee_agent_amount > 0",
+    "ix_credit_events_upstream_tx_id_hash": "CREATE INDEX CONCURRENTLY "
+    "ix_credit_events_upstream_tx_id_hash "
+    "ON credit_events USING hash (upstream_tx_id)",
+}
+
+# Advisory lock key, only one process builds indexes at a time
+INDEX_MIGRATION_LOCK_KEY = 4_815_162_342
+
+# Keep a reference so the background index migration is not garbage collected
+_index_migration_task = None
+
+
+async def migrate_indexes_concurrently(engine) -> None:
+    """Build missing indexes without locking out writes.
+
+    CONCURRENTLY can not run inside a transaction, so the statements run on an
+    autocommit connection. A session advisory lock lets only one process build
+    at a time, the others skip. A failed or interrupted build leaves an invalid
+    index behind, it is dropped and rebuilt by the next process that migrates.
+    The advisory lock needs a session-level connection, so migrate against
+    Postgres directly rather than through PgBouncer transaction mode.
+
+    Args:
+        engine: SQLAlchemy engine
+    """
+    try:
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            locked = await conn.scalar(
+                text("SELECT pg_try_advisory_lock(:key)"),
+                {"key": INDEX_MIGRATION_LOCK_KEY},
+            )
+            if not locked:
+                logger.info("Index migration is running in another process")
+                return
+            try:
+                for name, statement in CONCURRENT_INDEXES.items():
+                    valid = await conn.scalar(
+                        text(
+                            "SELECT indisvalid FROM pg_index "
+                            "WHERE indexrelid = to_regclass(:name)"
+                        ),
+                        {"name": name},
+                    )
+                    if valid:
+                        continue
+                    if valid is not None:
+                        # Left behind by a failed or interrupted build
+                        await conn.execute(
+                            text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                        )
+                        logger.info(f"Dropped invalid index {name}")
+                    await conn.execute(text(statement))
+                    logger.info(f"Added index {name}")
+            finally:
+                await conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"),
+                    {"key": INDEX_MIGRATION_LOCK_KEY},
+                )
+    except Exception as e:
+        logger.error(f"Error migrating indexes: {str(e)}")
+
+
 async def update_table_schema(conn, dialect, model_cls) -> None:
     """Update table schema by adding missing columns from the model.
 
@@ -100,4 +174,9 @@ async def safe_migrate(engine) -> None:
             logger.error(f"Error updating database schema: {str(e)}")
             raise
 
+    # Index builds scan whole tables, run them in the background so they don't
+    # hold up startup
+    global _index_migration_task
+    _index_migration_task = asyncio.create_task(migrate_indexes_concurrently(engine))
+
     logger.info("Database schema updated successfully")